@@ -0,0 +1,228 @@
+""" Statistical significance of every factor against no_show.
+
+The functions in this module work on the cleaned dataframe produced in the
+Data Wrangling section of the notebook (lowercase column labels, `days_name`
+column and `no_show` column of 'Yes'/'No' values). Every factor is counted once
+into a single contingency tensor and all tests are then run as batched NumPy
+operations on that tensor, so the cost of the tests does not grow with the
+number of rows.
+
+Example:
+    import significance_tests as st
+    factor_df, level_df = st.significance_report(med_df)
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+
+# factors tested against no_show, as column labels of the cleaned dataframe
+FACTORS = ['gender', 'days_name', 'scholarship', 'sms_received', 'hipertension',
+           'diabetes', 'alcoholism', 'handcap', 'age_band', 'neighbourhood']
+
+# age bands; 37 is the average age used in the notebook to split young and adult patients
+AGE_BINS = [-np.inf, 12, 18, 37, 60, np.inf]
+AGE_LABELS = ['0-12', '13-18', '19-37', '38-60', '61+']
+
+
+def age_band(age):
+    """ Grouping age column into age bands """
+    return pd.cut(age, bins=AGE_BINS, labels=AGE_LABELS)
+
+
+def _factor_column(df, factor):
+    """ Column of a factor, age_band is derived from age when it is not in dataframe """
+    if factor == 'age_band' and factor not in df.columns:
+        return age_band(df['age'])
+    return df[factor]
+
+
+def contingency_tensor(df, factors=FACTORS, target='no_show'):
+    """ Counting every factor against target into one tensor.
+
+    Returns a tuple of three items:
+    counts = integer array of shape (factors, max levels, 2), where the last
+             axis holds (present, absent) counts. Factors with fewer levels
+             are padded with zero rows
+    levels = list holding level labels of each factor
+    n_levels = number of levels of each factor
+    """
+    # absent patients are 1 and present patients are 0
+    y = (df[target].to_numpy() == 'Yes').astype(np.int64)
+
+    codes, levels = [], []
+    for factor in factors:
+        code, uniques = pd.factorize(_factor_column(df, factor), sort=True)
+        codes.append(code)
+        levels.append(list(uniques))
+
+    n_levels = np.array([len(level) for level in levels])
+    counts = np.zeros((len(factors), n_levels.max(), 2), dtype=np.int64)
+    for i, code in enumerate(codes):
+        # rows with missing values have code -1 and are left out
+        valid = code >= 0
+        cell = code[valid] * 2 + y[valid]
+        counts[i, :n_levels[i]] = np.bincount(cell, minlength=n_levels[i] * 2).reshape(-1, 2)
+    return counts, levels, n_levels
+
+
+def _expected(counts):
+    """ Expected counts of each cell under independence """
+    counts = counts.astype(np.float64)
+    row_total = counts.sum(axis=-1, keepdims=True)
+    col_total = counts.sum(axis=-2, keepdims=True)
+    total = counts.sum(axis=(-2, -1), keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total > 0, row_total * col_total / total, 0.0)
+
+
+def chi_square_stat(counts):
+    """ Pearson chi-square statistic over the last two axes of counts """
+    expected = _expected(counts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cell = np.where(expected > 0, (counts - expected) ** 2 / expected, 0.0)
+    return cell.sum(axis=(-2, -1))
+
+
+def g_stat(counts):
+    """ G-test (log-likelihood ratio) statistic over the last two axes of counts """
+    expected = _expected(counts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cell = np.where(counts > 0, counts * np.log(counts / expected), 0.0)
+    return 2 * cell.sum(axis=(-2, -1))
+
+
+def degrees_of_freedom(counts):
+    """ Degrees of freedom of each table, ignoring padded and empty rows and columns """
+    rows = (counts.sum(axis=-1) > 0).sum(axis=-1)
+    cols = (counts.sum(axis=-2) > 0).sum(axis=-1)
+    return np.clip((rows - 1) * (cols - 1), 0, None)
+
+
+def permutation_pvalues(counts, n_levels, n_permutations=10000, seed=None):
+    """ Permutation p-values of the chi-square statistic of each factor.
+
+    Shuffling no_show across patients leaves the level sizes of a factor and
+    the total number of absent patients unchanged, so the absent counts of a
+    shuffled table follow a multivariate hypergeometric distribution. All
+    shuffles of a factor are drawn at once from that distribution instead of
+    permuting millions of rows, and their statistics are computed in one batch.
+    """
+    rng = np.random.default_rng(seed)
+    observed = chi_square_stat(counts)
+    pvalues = np.ones(len(counts))
+    for i, k in enumerate(n_levels):
+        level_size = counts[i, :k].sum(axis=-1)
+        n_absent = counts[i, :k, 1].sum()
+        if k < 2 or n_absent == 0 or n_absent == level_size.sum():
+            continue
+        absent = rng.multivariate_hypergeometric(level_size, n_absent,
+                                                 size=n_permutations, method='marginals')
+        shuffled = np.stack([level_size - absent, absent], axis=-1)
+        exceed = (chi_square_stat(shuffled) >= observed[i] * (1 - 1e-12)).sum()
+        pvalues[i] = (exceed + 1) / (n_permutations + 1)
+    return pvalues
+
+
+def two_proportion_tests(counts, n_levels):
+    """ Two-proportion z-test of no_show rate of each level against all other levels.
+
+    Returns arrays of shape (factors, max levels) holding rate of the level,
+    rate of the other levels, z statistic and two-sided p-value. Padded levels
+    are NaN.
+    """
+    counts = counts.astype(np.float64)
+    level_size = counts.sum(axis=-1)
+    level_absent = counts[..., 1]
+    total = level_size.sum(axis=-1, keepdims=True)
+    total_absent = level_absent.sum(axis=-1, keepdims=True)
+    rest_size = total - level_size
+    rest_absent = total_absent - level_absent
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rate = level_absent / level_size
+        rest_rate = rest_absent / rest_size
+        pooled = total_absent / total
+        se = np.sqrt(pooled * (1 - pooled) * (1 / level_size + 1 / rest_size))
+        z = (rate - rest_rate) / se
+    pvalues = 2 * stats.norm.sf(np.abs(z))
+
+    padded = np.arange(counts.shape[1]) >= n_levels[:, None]
+    for arr in (rate, rest_rate, z, pvalues):
+        arr[padded] = np.nan
+    return rate, rest_rate, z, pvalues
+
+
+def holm(pvalues):
+    """ Holm-Bonferroni adjusted p-values, NaN values are left out """
+    pvalues = np.asarray(pvalues, dtype=np.float64)
+    adjusted = np.full(pvalues.shape, np.nan)
+    valid = ~np.isnan(pvalues)
+    p = pvalues[valid]
+    m = len(p)
+    order = np.argsort(p)
+    scaled = np.maximum.accumulate((m - np.arange(m)) * p[order])
+    result = np.empty(m)
+    result[order] = np.minimum(scaled, 1)
+    adjusted[valid] = result
+    return adjusted
+
+
+def benjamini_hochberg(pvalues):
+    """ Benjamini-Hochberg false discovery rate adjusted p-values, NaN values are left out """
+    pvalues = np.asarray(pvalues, dtype=np.float64)
+    adjusted = np.full(pvalues.shape, np.nan)
+    valid = ~np.isnan(pvalues)
+    p = pvalues[valid]
+    m = len(p)
+    order = np.argsort(p)
+    scaled = p[order] * m / np.arange(1, m + 1)
+    scaled = np.minimum.accumulate(scaled[::-1])[::-1]
+    result = np.empty(m)
+    result[order] = np.minimum(scaled, 1)
+    adjusted[valid] = result
+    return adjusted
+
+
+def significance_report(df, factors=FACTORS, n_permutations=10000, seed=None):
+    """ Testing every factor against no_show.
+
+    Returns two dataframes:
+    factor_df = chi-square, G-test and permutation p-values of each factor,
+                with Holm and Benjamini-Hochberg adjusted p-values
+    level_df = two-proportion test of each level against the other levels
+               of its factor (e.g. each neighbourhood against the rest),
+               with adjusted p-values across all levels
+    """
+    counts, levels, n_levels = contingency_tensor(df, factors)
+
+    dof = degrees_of_freedom(counts)
+    chi2 = chi_square_stat(counts)
+    g = g_stat(counts)
+    with np.errstate(invalid='ignore'):
+        chi2_p = np.where(dof > 0, stats.chi2.sf(chi2, np.maximum(dof, 1)), 1.0)
+        g_p = np.where(dof > 0, stats.chi2.sf(g, np.maximum(dof, 1)), 1.0)
+    perm_p = permutation_pvalues(counts, n_levels, n_permutations, seed)
+
+    factor_df = pd.DataFrame({'factor': factors, 'levels': n_levels, 'dof': dof,
+                              'chi2': chi2, 'chi2_p': chi2_p, 'g': g, 'g_p': g_p,
+                              'permutation_p': perm_p})
+    factor_df['chi2_p_holm'] = holm(chi2_p)
+    factor_df['chi2_p_bh'] = benjamini_hochberg(chi2_p)
+    factor_df['permutation_p_holm'] = holm(perm_p)
+
+    rate, rest_rate, z, prop_p = two_proportion_tests(counts, n_levels)
+    valid = np.arange(counts.shape[1]) < n_levels[:, None]
+    factor_idx, level_idx = np.nonzero(valid)
+    level_df = pd.DataFrame({
+        'factor': np.array(factors)[factor_idx],
+        'level': [levels[f][l] for f, l in zip(factor_idx, level_idx)],
+        'patients': counts[factor_idx, level_idx].sum(axis=-1),
+        'no_show_rate': rate[factor_idx, level_idx],
+        'rest_no_show_rate': rest_rate[factor_idx, level_idx],
+        'z': z[factor_idx, level_idx],
+        'p': prop_p[factor_idx, level_idx]})
+    level_df['p_holm'] = holm(level_df['p'].to_numpy())
+    level_df['p_bh'] = benjamini_hochberg(level_df['p'].to_numpy())
+    return factor_df, level_df